@@ -1,24 +1,55 @@
 import sys
 import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import html
 import sqlite3
-from time import sleep
-REG_CATEGORIES = r'<table>[\S\s]*?<td class="(category_name|category_comments)">(.*?)<\/td>[\S\s]*?<td class="(category_name|category_comments)">(.*?)<\/td>[\S\s]*?<\/table>'
-REG_QUESTIONS = r'(?:correct_response&quot;&gt;(.*?)&lt;\/em&gt;[\s\S]*?class="clue_text">(.*?)<\/td>|<td class="clue">\s*?<\/td>)'
-REG_EPS = r'\"(https:\/\/www\.j-archive\.com\/showgame\.php\?game_id=\d+)\"'
-REG_CAT_COMMENT = r'\(.+?:\s+(.*)\)'
-REG_HTML_TAGS = r'<[^>]+>'
-REG_SHOW_NUM = r'<div id=\"game_title\"><h1>Show #(\d+).*?(\d{4})<\/h1>'
-REG_SEASON_NUMBERS = r'<a href=\"showseason\.php\?season=(\d+)\"'
+from time import sleep, monotonic
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+REG_CATEGORIES = re.compile(r'<table>[\S\s]*?<td class="(category_name|category_comments)">(.*?)<\/td>[\S\s]*?<td class="(category_name|category_comments)">(.*?)<\/td>[\S\s]*?<\/table>')
+REG_QUESTIONS = re.compile(r'(?:correct_response&quot;&gt;(.*?)&lt;\/em&gt;[\s\S]*?class="clue_text">(.*?)<\/td>|<td class="clue">\s*?<\/td>)')
+REG_EPS = re.compile(r'\"(https:\/\/www\.j-archive\.com\/showgame\.php\?game_id=\d+)\"')
+REG_CAT_COMMENT = re.compile(r'\(.+?:\s+(.*)\)')
+REG_HTML_TAGS = re.compile(r'<[^>]+>')
+REG_SHOW_NUM = re.compile(r'<div id=\"game_title\"><h1>Show #(\d+).*?(\d{4})<\/h1>')
+REG_SEASON_NUMBERS = re.compile(r'<a href=\"showseason\.php\?season=(\d+)\"')
+REG_LINK = re.compile(r'a href', re.IGNORECASE)
+
+ROUNDS_START = 'id="jeopardy_round"'
+ROUNDS_END = 'id="final_jeopardy_round"'
 
 SEASON_LIST_URL = 'https://j-archive.com/listseasons.php'
 SEASON_URL = 'https://www.j-archive.com/showseason.php?season='
 
+FETCH_WORKERS = 4
+# minimum seconds between any two requests, shared by all workers (2 req/s)
+FETCH_INTERVAL = .5
+FETCH_TIMEOUT = 10
+
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=FETCH_WORKERS,
+    max_retries=Retry(total=3, backoff_factor=0.5)))
+
+# every request from every worker takes its turn through this
+FETCH_LOCK = Lock()
+next_fetch_time = 0
+
+# category slot and dollar value for each of the 60 clues in page order
+CLUE_CATEGORY = tuple((i % 6) + 6 * (i // 30) for i in range(60))
+CLUE_VALUE = tuple([200, 400, 600, 800, 1000][(i % 30) // 6] for i in range(60))
+
 sample_page = 'https://www.j-archive.com/showgame.php?game_id=7094'
 
 def build_tables(db_path):
     con = sqlite3.connect(db_path)
+    create_tables(con)
+    con.close()
+
+def create_tables(con):
     cur = con.cursor()
     cur.execute('''CREATE TABLE IF NOT EXISTS category
                (id INTEGER NOT NULL PRIMARY KEY, show_number number, show_year number, title text, comment text)''')
@@ -26,32 +57,63 @@ def build_tables(db_path):
     cur.execute('''CREATE TABLE IF NOT EXISTS question
                (id INTEGER NOT NULL PRIMARY KEY, category_id number, value number, question text, answer text, non_text number)''')
 
+    cur.execute('''CREATE INDEX IF NOT EXISTS idx_category_show_number ON category(show_number)''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS idx_question_category_id ON question(category_id)''')
+
     con.commit()
-    con.close()
 
-def parse_page(url, db_path):
+def wait_for_fetch_slot():
+    # reserve the next free slot under the lock, then sleep outside it so the
+    # combined rate of all workers stays at one request per FETCH_INTERVAL
+    global next_fetch_time
+    with FETCH_LOCK:
+        now = monotonic()
+        wait = next_fetch_time - now
+        next_fetch_time = max(now, next_fetch_time) + FETCH_INTERVAL
+
+    if wait > 0:
+        sleep(wait)
+
+def get_page(url):
+    wait_for_fetch_slot()
+    response = SESSION.get(url, timeout=FETCH_TIMEOUT)
+    response.raise_for_status()
+    # decode the bytes once ourselves, requests guesses latin-1 when the
+    # content type has no charset
+    return response.content.decode('utf-8')
+
+def connect_db(db_path):
     con = sqlite3.connect(db_path)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('PRAGMA synchronous=NORMAL')
+    con.execute('PRAGMA temp_store=MEMORY')
+    con.execute('PRAGMA cache_size=-20000')
+    return con
+
+def get_known_shows(con):
+    return {row[0] for row in con.execute('''SELECT DISTINCT show_number FROM category''')}
+
+def parse_page(page_content, con, known_shows):
     cur = con.cursor()
-    cats = []
+    cats = [0] * 12
     questions = []
-    scores = [200, 400, 600, 800, 1000]
 
-    page_content = requests.get(url).content.decode('utf-8')
-    show_info = re.search(REG_SHOW_NUM, page_content)
+    show_info = REG_SHOW_NUM.search(page_content)
     show_num = int(show_info[1])
     show_year = int(show_info[2])
 
-    cur.execute('''SELECT DISTINCT show_number FROM category WHERE show_number = ?''', (show_num, ))
-    if len(cur.fetchall()) > 0:
+    if show_num in known_shows:
         raise IndexError('Already have this episode')
 
-    matches = re.findall(REG_CATEGORIES, page_content)[:12]
+    rounds_content = get_rounds_content(page_content)
+
+    matches = REG_CATEGORIES.findall(rounds_content)[:12]
     if len(matches) != 12:
         con.rollback()
         raise IndexError('Wrong number of categories found! ' + str(len(matches)))
 
     # sometimes name and category are reversed
-    for match in matches:
+    for i, match in enumerate(matches):
         if match[0] == 'category_name':
             category_name_index = 1
             category_comment_index = 3
@@ -63,7 +125,7 @@ def parse_page(url, db_path):
         comment = clean_string(match[category_comment_index])
 
         # get rid of the (so-and-so: ) part of the comment
-        com_match = re.match(REG_CAT_COMMENT, comment)
+        com_match = REG_CAT_COMMENT.match(comment)
         if com_match:
             comment = com_match[1]
 
@@ -71,74 +133,103 @@ def parse_page(url, db_path):
             comment = None
 
         cur.execute('''INSERT INTO category (show_number, show_year, title, comment) VALUES (?, ?, ?, ?)''', (show_num, show_year, category, comment))
-        cats.append(cur.lastrowid)
+        cats[i] = cur.lastrowid
 
-    matches = re.findall(REG_QUESTIONS, page_content)
-    if len(matches) != 60:
-        con.rollback()
-        raise IndexError('Wrong number of questions found!' + str(len(matches)))
+    question_count = 0
+    for clue in REG_QUESTIONS.finditer(rounds_content):
+        i = question_count
+        question_count += 1
+        answer, question = clue.groups()
 
-    for i, match in enumerate(matches):
-        if len(match) < 2 or match[0] == '' or match[1] == '':
+        # empty clues match with no groups, extra matches fail the count below
+        if i >= 60 or not answer or not question:
             continue
 
-        cat = cats[(i % 6) + 6 * (i // 30)]
-        score = scores[(i % 30) // 6]
-        question = match[1]
+        cat = cats[CLUE_CATEGORY[i]]
+        score = CLUE_VALUE[i]
         non_text = 0
-        if 'a href' in question.lower():
+        if REG_LINK.search(question):
             non_text = 1
         question = clean_string(question)
-        answer = clean_string(match[0])
-        cur.execute('''INSERT INTO question (category_id, value, question, answer, non_text) VALUES (?, ?, ?, ?, ?)''', 
-        (cat, score, question, answer, non_text))
+        answer = clean_string(answer)
+        questions.append((cat, score, question, answer, non_text))
+
+    if question_count != 60:
+        con.rollback()
+        raise IndexError('Wrong number of questions found!' + str(question_count))
+
+    cur.executemany('''INSERT INTO question (category_id, value, question, answer, non_text) VALUES (?, ?, ?, ?, ?)''', questions)
 
     con.commit()
-    con.close()
+    known_shows.add(show_num)
+
+def get_rounds_content(page_content):
+    # only the jeopardy and double jeopardy rounds hold the 12 categories and
+    # 60 clues, so keep the regexes from scanning the rest of the page
+    start = page_content.find(ROUNDS_START)
+    end = page_content.find(ROUNDS_END, start)
+
+    if start == -1 or end == -1:
+        return page_content
+
+    return page_content[start:end]
 
 def clean_string(s):
-    return re.sub(REG_HTML_TAGS, '', html.unescape(s)).replace('\\', '')
+    # entities must be decoded before stripping tags, answers often contain
+    # escaped markup like &lt;i&gt;
+    s = html.unescape(s)
+    if '<' in s:
+        s = REG_HTML_TAGS.sub('', s)
+    return s.replace('\\', '')
 
 def scan_season(number, db_path):
     url = SEASON_URL + str(number)
     print(url)
-    page_content = requests.get(url).content.decode('utf-8')
-    matches = re.finditer(REG_EPS, page_content)
-
-    for match in matches:
-        ep_url = match[1]
-        print(ep_url)
-        try:
-            parse_page(ep_url, db_path)
-            sleep(.5)
-        except Exception as ex:
-            print(str(ex))
+    page_content = get_page(url)
+    ep_urls = [match[1] for match in REG_EPS.finditer(page_content)]
+    con = connect_db(db_path)
+    known_shows = get_known_shows(con)
+
+    # pages are downloaded concurrently but only this thread writes to the db
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        pages = [executor.submit(get_page, ep_url) for ep_url in ep_urls]
+
+        for ep_url, page in zip(ep_urls, pages):
+            print(ep_url)
+            try:
+                parse_page(page.result(), con, known_shows)
+            except Exception as ex:
+                # don't let a half parsed page get committed with the next one
+                con.rollback()
+                print(str(ex))
+
+    con.close()
 
 def get_seasons():
-    page_content = requests.get(SEASON_LIST_URL).content.decode('utf-8')
-    seasons = [int(s) for s in re.findall(REG_SEASON_NUMBERS, page_content)]
+    page_content = get_page(SEASON_LIST_URL)
+    seasons = [int(s) for s in REG_SEASON_NUMBERS.findall(page_content)]
     return seasons
 
-db_path = sys.argv[1]
-commands = sys.argv[2:]
-
-if len(commands) == 0:
-    exit(
-            'usage:\n'
-            f'{sys.argv[0]} latest\n'
-            f'{sys.argv[0]} season x\n'
-            )
+if __name__ == '__main__':
+    db_path = sys.argv[1]
+    commands = sys.argv[2:]
 
-if commands[0] == 'latest':
-    season = max(get_seasons())
+    if len(commands) == 0:
+        exit(
+                'usage:\n'
+                f'{sys.argv[0]} latest\n'
+                f'{sys.argv[0]} season x\n'
+                )
 
-elif commands[0].startswith('season'):
-    if len(commands[0]) > len('season'):
-        season = int(commands[0][len('season'):])
+    if commands[0] == 'latest':
+        season = max(get_seasons())
 
-    else:
-        season = int(commands[1])
+    elif commands[0].startswith('season'):
+        if len(commands[0]) > len('season'):
+            season = int(commands[0][len('season'):])
 
-build_tables(sys.argv[1])
-scan_season(season, sys.argv[1])
+        else:
+            season = int(commands[1])
 
+    build_tables(sys.argv[1])
+    scan_season(season, sys.argv[1])
@@ -1,29 +1,292 @@
-import inspect
+import sys
+import sqlite3
 import unittest
 import logging
-from time import time
+from time import time, sleep
 from datetime import datetime
-from unittest.mock import Mock, patch, ANY
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Event
+from types import SimpleNamespace
+from unittest.mock import Mock, patch, call, ANY
 
-from trivia_core import TriviaCore
+import scrape
+import trivia_core
+from trivia_core import TriviaCore, _apply_config_defaults
 
 def ln():
-    return inspect.currentframe().f_back.f_lineno
+    return sys._getframe(1).f_lineno
+
+class FakeTime:
+    """
+    Stand in for time.time that ticks step seconds per call
+    """
+    __slots__ = ('t', 'step')
+
+    def __init__(self, t=0, step=1):
+        self.t = t
+        self.step = step
+
+    def __call__(self):
+        self.t += self.step
+        return self.t - self.step
+
+def expected_rows(exp_scores):
+    """
+    Parsed scoreboard rows for (uid, correct, incorrect) tuples
+    """
+    return [[
+        str(i+1),
+        uid,
+        f'{correct*200:,}',
+        str(correct),
+        str(incorrect),
+        str(correct * 100 // (correct + incorrect))
+        ] for i, (uid, correct, incorrect) in enumerate(exp_scores)]
+
+# given answer and correct answer pairs for the answer matching tests
+CORRECT_ANSWERS = (
+    ('test', 'test'),
+    ('python', 'python'),
+    ('five', '5'),
+    ('cdefg', 'abcdefghi'),
+    ('ONEtwoTHREE', 'onetwothree'),
+    ('one two three', 'onetwothree'),
+    ('Thom Yorke', 'Thom (Yorke)'),
+    ('one & two', 'one and two'),
+    ('pie', 'a pie'),
+    ('act', 'an act'),
+    ('cat', 'the cat'),
+    ('cliche', 'cliché'),
+    ('10%', '10 percent'),
+    (' abcde ', 'abcde'),
+    ('5', 'five'),
+    ('r&b', 'r and b'),
+)
+
+INCORRECT_ANSWERS = (
+    ('one', 'two'),
+    ('1', '2'),
+    ('1950s', '1960s'),
+    ('two', 'one two three'),
+    ('abcd', 'abcde'),
+    ('ab\ncde', 'abcde'),
+)
+
+# line, operation and data for each step of test_question
+QUESTION_OPERATIONS = (
+    (ln(), 'setdate', (2000, 1, 2)),
+    (ln(), 'wronganswer', 'a'),
+    (ln(), 'q_no_post', None),
+    (ln(), 'wronganswer', 'b'),
+    (ln(), 'q_no_post', None),
+    (ln(), 'answer', 'a'),
+    (ln(), 'q_post', {'uid': 'a', 'rank': 1}),
+    (ln(), 'answer', 'a'),
+    (ln(), 'q_post', {'uid': 'a', 'rank': 1}),
+    (ln(), 'answer', 'a'),
+    (ln(), 'q_post', {'uid': 'a', 'rank': 1}),
+    (ln(), 'answer', 'b'),
+    (ln(), 'q_post', {'uid': 'b', 'rank': 2}),
+    (ln(), 'answer', 'b'),
+    (ln(), 'q_post', {'uid': 'b', 'rank': 2}),
+    (ln(), 'answer', 'c'),
+    (ln(), 'q_post', {'uid': 'c', 'rank': 3}),
+    (ln(), 'scoreboard_cmd', ('!today', 'Sunday January 02 2000', (
+        ('a', 3, 0), # "a" gets it wrong then right so not in incorrect
+        ('b', 2, 1),
+        ('c', 1, 0),
+    ))),
+
+    (ln(), 'setdate', (2000, 1, 3)),
+    (ln(), 'scoreboard_cmd', ('!yesterday', 'Sunday January 02 2000', (
+        ('a', 3, 0),
+        ('b', 2, 1),
+        ('c', 1, 0),
+    ))),
+    (ln(), 'scoreboard', ({'days_ago': 2}, 'Saturday January 01 2000', (
+    ))),
+    (ln(), 'scoreboard', ({'days_ago': 2, 'suppress_no_scores': True}, 'Saturday January 01 2000', (
+    ))),
+    (ln(), 'scoreboard', ({'weeks_ago': 1}, 'week starting Sunday December 26 1999', (
+    ))),
+    (ln(), 'answer', 'b'),
+    (ln(), 'q_post', {'uid': 'b', 'rank': 1}),
+    (ln(), 'wronganswer', 'b'),
+    (ln(), 'q_no_post', None),
+    (ln(), 'answer', 'b'),
+    (ln(), 'q_post', {'uid': 'b', 'rank': 1}),
+    (ln(), 'scoreboard_cmd', ('!week', 'week starting Sunday January 02 2000', (
+        ('b', 4, 1),
+        ('a', 3, 0),
+        ('c', 1, 0),
+    ))),
+    (ln(), 'scoreboard_cmd', ('!month', 'January 2000', (
+        ('b', 4, 1),
+        ('a', 3, 0),
+        ('c', 1, 0),
+    ))),
+    (ln(), 'scoreboard_cmd', ('!year', '2000', (
+        ('b', 4, 1),
+        ('a', 3, 0),
+        ('c', 1, 0),
+    ))),
+    (ln(), 'scoreboard_cmd', ('!alltime', 'Alltime Scores', (
+        ('b', 4, 1),
+        ('a', 3, 0),
+        ('c', 1, 0),
+    ))),
+
+    (ln(), 'setdate', (2000, 2, 1)),
+    (ln(), 'answer', 'c'),
+    (ln(), 'answer', 'c'),
+    (ln(), 'wronganswer', 'a'),
+    (ln(), 'q_no_post', None),
+    (ln(), 'wronganswer', 'a'),
+    (ln(), 'q_no_post', None),
+    (ln(), 'wronganswer', 'a'), # only count 1 wrong per question
+    (ln(), 'q_no_post', None),
+    (ln(), 'answer', 'c'),
+    (ln(), 'answer', 'c'),
+    (ln(), 'wronganswer', 'c'),
+    (ln(), 'q_no_post', None),
+    (ln(), 'answer', 'b'),
+    (ln(), 'answer', 'b'),
+    (ln(), 'wronganswer', 'c'),
+    (ln(), 'q_no_post', None),
+    (ln(), 'answer', 'a'),
+    (ln(), 'scoreboard', ({'months_ago': 1}, 'January 2000', (
+        ('b', 4, 1),
+        ('a', 3, 0),
+        ('c', 1, 0),
+    ))),
+    (ln(), 'scoreboard_cmd', ('!today', 'Tuesday February 01 2000', (
+        ('c', 4, 2),
+        ('b', 2, 0),
+        ('a', 1, 1),
+    ))),
+    (ln(), 'scoreboard_cmd', ('!yesterday', 'Monday January 31 2000', (
+    ))),
+    (ln(), 'scoreboard_cmd', ('!month', 'February 2000', (
+        ('c', 4, 2),
+        ('b', 2, 0),
+        ('a', 1, 1),
+    ))),
+    (ln(), 'scoreboard_cmd', ('!alltime', 'Alltime Scores', (
+        ('b', 6, 1),
+        ('c', 5, 2),
+        ('a', 4, 1),
+    ))),
+    (ln(), 'answer', 'c'),
+    (ln(), 'q_post', {'uid': 'c', 'rank': 1}),
+    (ln(), 'answer', 'b'),
+    (ln(), 'q_post', {'uid': 'b', 'rank': 2}),
+    (ln(), 'answer', 'a'),
+    (ln(), 'q_post', {'uid': 'a', 'rank': 3}),
+    (ln(), 'answer', 'a'),
+    (ln(), 'q_post', {'uid': 'a', 'rank': 2}),
+    (ln(), 'answer', 'a'),
+    (ln(), 'q_post', {'uid': 'a', 'rank': 2}),
+    (ln(), 'answer', 'a'),
+    (ln(), 'q_post', {'uid': 'a', 'rank': 1}),
+    (ln(), 'answer', 'a'),
+    (ln(), 'q_post', {'uid': 'a', 'rank': 1}),
+    (ln(), 'answer', 'd'),
+    (ln(), 'q_post', {'uid': 'd', 'rank': 4}),
+    (ln(), 'scoreboard_cmd', ('!today', 'Tuesday February 01 2000', (
+        ('a', 6, 1),
+        ('c', 5, 2),
+        ('b', 3, 0),
+        ('d', 1, 0),
+    ))),
+
+
+
+    (ln(), 'setdate', (2001, 1, 1)),
+    (ln(), 'wronganswer', 'z'),
+    (ln(), 'q_no_post', None),
+    (ln(), 'answer', 'a'),
+    (ln(), 'answer', 'a'),
+    (ln(), 'answer', 'a'),
+    (ln(), 'answer', 'b'),
+    (ln(), 'answer', 'b'),
+    (ln(), 'answer', 'c'),
+    (ln(), 'scoreboard_cmd', ('!today', 'Monday January 01 2001', (
+        ('a', 3, 0),
+        ('b', 2, 0),
+        ('c', 1, 0),
+        ('z', 0, 1),
+    ))),
+    (ln(), 'scoreboard_cmd', ('!week', 'week starting Sunday December 31 2000', (
+        ('a', 3, 0),
+        ('b', 2, 0),
+        ('c', 1, 0),
+        ('z', 0, 1),
+    ))),
+    (ln(), 'scoreboard_cmd', ('!month', 'January 2001', (
+        ('a', 3, 0),
+        ('b', 2, 0),
+        ('c', 1, 0),
+        ('z', 0, 1),
+    ))),
+    (ln(), 'scoreboard_cmd', ('!year', '2001', (
+        ('a', 3, 0),
+        ('b', 2, 0),
+        ('c', 1, 0),
+        ('z', 0, 1),
+    ))),
+    (ln(), 'scoreboard_cmd', ('!alltime', 'Alltime Scores', (
+        ('a', 12, 1),
+        ('b', 9, 1),
+        ('c', 7, 2),
+        ('d', 1, 0),
+        ('z', 0, 1),
+    ))),
+    (ln(), 'scoreboard', ({'days_ago': 0}, 'Monday January 01 2001', (
+        ('a', 3, 0),
+        ('b', 2, 0),
+        ('c', 1, 0),
+        ('z', 0, 1),
+    ))),
+    (ln(), 'scoreboard', ({'weeks_ago': 1, 'suppress_no_scores': True}, 'week starting Sunday December 24 2000', (
+    ))),
+    (ln(), 'scoreboard', ({'weeks_ago': 1}, 'week starting Sunday December 24 2000', (
+    ))),
+    (ln(), 'scoreboard', ({'years_ago': 1}, '2000', (
+        ('a', 9, 1),
+        ('b', 7, 1),
+        ('c', 6, 2),
+        ('d', 1, 0),
+    ))),
+    (ln(), 'scoreboard', ({'months_ago': 12}, 'January 2000', (
+        ('b', 4, 1),
+        ('a', 3, 0),
+        ('c', 1, 0),
+    ))),
+    (ln(), 'scoreboard', ({'months_ago': -12}, 'January 2002', (
+    ))),
+    (ln(), 'scoreboard', ({'months_ago': 120}, 'January 1991', (
+    ))),
+)
 
 class TestTriviaCore(unittest.TestCase):
 
-    def setUp(self):
-        config = {
-          "database_path": ":memory:",
-          "admin_uid": "a",
-          "min_matching_characters": 5,
-          "scoreboard_schedule": [
-          ],
-          "scoreboard_show_incorrect": False,
-          "scoreboard_show_percent": False
-        }
+    CONFIG = {
+      "database_path": ":memory:",
+      "admin_uid": "a",
+      "min_matching_characters": 5,
+      "scoreboard_schedule": [
+      ],
+      "scoreboard_show_incorrect": False,
+      "scoreboard_show_percent": False
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        # Expected errors are logged by several tests, keep the output quiet
+        logging.disable(logging.CRITICAL)
+        cls.addClassCleanup(logging.disable, logging.NOTSET)
 
-        self._trivia = TriviaCore(**config, platform='test')
+        trivia = TriviaCore(**cls.CONFIG, platform='test')
         queries = {'test_add_categories': """
                     INSERT INTO category (show_number, show_year, title, comment
                     ) VALUES (
@@ -37,102 +300,137 @@ class TestTriviaCore(unittest.TestCase):
                       (SELECT id FROM category LIMIT 1), 200, 'question', 'answer', 0
                     )"""}
 
-        self._trivia._db._queries = {**self._trivia._db._queries, **queries}
+        trivia._db._queries = {**trivia._db._queries, **queries}
 
-        self._trivia._db.execute('test_add_categories', auto_commit=True)
-        self._trivia._db.execute('test_add_questions', auto_commit=True)
+        trivia._db.execute('test_add_categories')
+        trivia._db.execute('test_add_questions')
+        trivia._db.commit()
 
-    @staticmethod
-    def question_template(rank = ANY, uid=ANY, score=ANY, correct=ANY, incorrect=ANY, percent=ANY, **kwargs):
-        question_template = {
-                'winning_user': {
-                    'rank': rank,
-                    'uid': uid,
-                    'score': score,
-                    'correct': correct,
-                    'incorrect': incorrect,
-                    'percent': percent
-                    },
-                'winning_answer': ANY,
-                'id': ANY,
-                'category': ANY,
-                'comment': ANY,
-                'year': ANY,
-                'value': ANY,
-                'question': ANY,
-                'answer': ANY
+        # Each test starts from a copy of this database
+        cls._template_db = sqlite3.connect(':memory:')
+        trivia._db._connection.backup(cls._template_db)
+
+        # Handler mocks are shared by every test and reset in setUp
+        cls.mock_post_reply = Mock()
+        cls.mock_post_message = Mock()
+        cls.mock_ask_question = Mock()
+        cls.mock_error = Mock()
+        cls.mock_correct_answer = Mock()
+        cls.mock_display_name = Mock()
+        cls.mock_display_names = Mock()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._template_db.close()
+
+    def setUp(self):
+        self._trivia = TriviaCore(**self.CONFIG, platform='test')
+        self._template_db.backup(self._trivia._db._connection)
+
+        for mock in (
+                self.mock_post_reply,
+                self.mock_post_message,
+                self.mock_ask_question,
+                self.mock_error,
+                self.mock_correct_answer,
+                self.mock_display_name,
+                self.mock_display_names):
+            mock.reset_mock(return_value=True, side_effect=True)
+
+        # Registering these has no side effects, unlike on_post_question
+        # which asks the first question
+        self._trivia.on_post_reply(self.mock_post_reply)
+        self._trivia.on_post_message(self.mock_post_message)
+        self._trivia.on_error(self.mock_error)
+
+    QUESTION_TEMPLATE = {
+            'winning_user': None,
+            'winning_answer': ANY,
+            'id': ANY,
+            'category': ANY,
+            'comment': ANY,
+            'year': ANY,
+            'value': ANY,
+            'question': ANY,
+            'answer': ANY
+            }
+
+    @classmethod
+    def question_template(cls, rank = ANY, uid=ANY, score=ANY, correct=ANY, incorrect=ANY, percent=ANY, **kwargs):
+        question_template = cls.QUESTION_TEMPLATE.copy()
+        question_template['winning_user'] = {
+                'rank': rank,
+                'uid': uid,
+                'score': score,
+                'correct': correct,
+                'incorrect': incorrect,
+                'percent': percent
                 }
-        return {**question_template, **kwargs}
+        question_template.update(kwargs)
+        return question_template
 
     @staticmethod
     def parse_scoreboard(scoreboard_str:str):
         return [line.split() for line in scoreboard_str.strip().split('\n')[4:]]
 
     def test_disabled_commands(self):
-        mock_post_reply = Mock()
-        self._trivia.on_post_reply(mock_post_reply)
-
         self._trivia.handle_message('a', '!alltime', 'payload')
-        mock_post_reply.assert_called()
-        mock_post_reply.reset_mock()
+        self.mock_post_reply.assert_called()
+        self.mock_post_reply.reset_mock()
 
         self._trivia._config['disabled_commands'] = ['alltime']
         self._trivia.handle_message('a', '!alltime', 'payload')
-        mock_post_reply.assert_not_called()
-        mock_post_reply.reset_mock()
+        self.mock_post_reply.assert_not_called()
+        self.mock_post_reply.reset_mock()
 
         self._trivia.handle_message('a', '!scores', 'payload')
-        mock_post_reply.assert_not_called()
-        mock_post_reply.reset_mock()
+        self.mock_post_reply.assert_not_called()
+        self.mock_post_reply.reset_mock()
 
         self._trivia.handle_message('a', '!today', 'payload')
-        mock_post_reply.assert_called()
-        mock_post_reply.reset_mock()
+        self.mock_post_reply.assert_called()
+        self.mock_post_reply.reset_mock()
 
         self._trivia.handle_message('a', '!help', 'payload')
-        mock_post_reply.assert_called()
-        args, _ = mock_post_reply.call_args
+        self.mock_post_reply.assert_called()
+        args, _ = self.mock_post_reply.call_args
         self.assertNotIn('alltime', args[0])
 
 
-    @patch('trivia_core.time')
-    def test_new(self, mock_time):
-        mock_time.return_value = 0
-        mock_ask_question = Mock()
-        mock_post_reply = Mock()
-        mock_error = Mock()
-        self._trivia.on_post_question(mock_ask_question)
-        self._trivia.on_post_reply(mock_post_reply)
-        self._trivia.on_error(mock_error)
+    def test_new(self):
+        fake_time = FakeTime(step=0)
+        self.addCleanup(setattr, trivia_core, 'time', trivia_core.time)
+        trivia_core.time = fake_time
+        self._trivia.on_post_question(self.mock_ask_question)
 
         self._trivia.handle_message('a', '!new', 'payload')
-        mock_ask_question.assert_called()
-        mock_post_reply.assert_not_called()
-        mock_error.assert_not_called()
+        self.mock_ask_question.assert_called()
+        self.mock_post_reply.assert_not_called()
+        self.mock_error.assert_not_called()
 
-        mock_ask_question.reset_mock()
-        mock_post_reply.reset_mock()
-        mock_error.reset_mock()
+        self.mock_ask_question.reset_mock()
+        self.mock_post_reply.reset_mock()
+        self.mock_error.reset_mock()
 
         self._trivia._config['min_seconds_before_new'] = 120
-        mock_time.return_value = 100
+        fake_time.t = 100
         self._trivia.handle_message('a', '!new', 'payload')
-        mock_ask_question.assert_not_called()
-        mock_post_reply.assert_not_called()
-        mock_error.assert_called()
-        _, error_kwargs = mock_error.call_args
+        self.mock_ask_question.assert_not_called()
+        self.mock_post_reply.assert_not_called()
+        self.mock_error.assert_called()
+        _, error_kwargs = self.mock_error.call_args
         self.assertIn('20 seconds', error_kwargs['text'])
 
-        mock_ask_question.reset_mock()
-        mock_post_reply.reset_mock()
-        mock_error.reset_mock()
+        self.mock_ask_question.reset_mock()
+        self.mock_post_reply.reset_mock()
+        self.mock_error.reset_mock()
 
-        mock_time.return_value = 120
+        fake_time.t = 120
 
         self._trivia.handle_message('a', '!new', 'payload')
-        mock_ask_question.assert_called()
-        mock_post_reply.assert_not_called()
-        mock_error.assert_not_called()
+        self.mock_ask_question.assert_called()
+        self.mock_post_reply.assert_not_called()
+        self.mock_error.assert_not_called()
 
 
     def test_scoreboard_schedule(self):
@@ -166,20 +464,22 @@ class TestTriviaCore(unittest.TestCase):
         self.assertGreaterEqual(jobs[0].next_run_time.timestamp() - time(), 0)
 
 
+    def test_no_scoreboard_schedule(self):
+        """Test that no scheduler thread is started without a schedule
+        """
+        self.assertFalse(self._trivia._sched.running)
+
     @patch('os.kill')
     def test_exit(self, os_kill):
         """Test exit command by admin and unallowed non-admin
         """
-        mock_ask_question = Mock()
-        mock_post_reply = Mock()
-        self._trivia.on_post_question(mock_ask_question)
-        self._trivia.on_post_reply(mock_post_reply)
+        self._trivia.on_post_question(self.mock_ask_question)
 
         self._trivia.handle_message('b', '!exit', 'payload')
-        mock_post_reply.assert_not_called()
+        self.mock_post_reply.assert_not_called()
 
         self._trivia.handle_message('a', '!exit', 'payload')
-        mock_post_reply.assert_called_with('ok bye', message_payload='payload')
+        self.mock_post_reply.assert_called_with('ok bye', message_payload='payload')
         os_kill.assert_called()
 
     def test_db_commit(self):
@@ -191,29 +491,28 @@ class TestTriviaCore(unittest.TestCase):
         """Bonehead test for coverage
         """
         bad_string = b'\0010010'
-        logging.disable(logging.CRITICAL)
         results = self._trivia._answer_variants(bad_string)
-        logging.disable(logging.NOTSET)
-        self.assertEqual(len(results), 1)
-        self.assertEqual(results[0], bad_string)
+        self.assertEqual(results, frozenset([bad_string]))
 
     def test_missing_configs(self):
         """
         Trivia Core should complain and set defaults for some missing config options
         """
         config = {
-          "database_path": ":memory:",
           "admin_uid": "a",
           "min_matching_characters": 5,
           "scoreboard_schedule": [
           ],
         }
 
+        logging.disable(logging.NOTSET)
+        self.addCleanup(logging.disable, logging.CRITICAL)
+
         with self.assertLogs(level=logging.WARNING):
-            self._trivia = TriviaCore(**config, platform='test')
+            config = _apply_config_defaults(config)
 
-        self.assertEqual(self._trivia._config['scoreboard_show_incorrect'], False)
-        self.assertEqual(self._trivia._config['scoreboard_show_percent'], False)
+        self.assertEqual(config['scoreboard_show_incorrect'], False)
+        self.assertEqual(config['scoreboard_show_percent'], False)
 
     def test_no_question_handler(self):
         """
@@ -227,11 +526,9 @@ class TestTriviaCore(unittest.TestCase):
         Test the pre_format handler
         """
         self._trivia.on_pre_format(lambda x: f'```{x}```')
-        mock_post_reply = Mock()
-        self._trivia.on_post_reply(mock_post_reply)
-        self._trivia.on_post_question(lambda *_, **__: None)
+        self._trivia.on_post_question(self.mock_ask_question)
         self._trivia.handle_message('b', '!help', 'payload')
-        message = mock_post_reply.call_args[0][0]
+        message = self.mock_post_reply.call_args[0][0]
         self.assertEqual(message[:3], '```')
         self.assertEqual(message[-3:], '```')
 
@@ -240,52 +537,240 @@ class TestTriviaCore(unittest.TestCase):
         Test the get_display name handler
         """
         self._trivia.on_get_display_name(lambda x: x.upper())
-        mock_post_reply = Mock()
-        self._trivia.on_post_reply(mock_post_reply)
-        self._trivia.on_post_question(lambda *_, **__: None)
+        self._trivia.on_post_question(self.mock_ask_question)
         self._trivia.handle_message('a', 'answer', 'payload')
         self._trivia.handle_message('a', '!today', 'payload')
-        message = mock_post_reply.call_args[0][0]
+        message = self.mock_post_reply.call_args[0][0]
         username = message.strip().split('\n')[4].split()[1]
         self.assertEqual(username, 'A')
 
+    def test_numeric_display_names(self):
+        """
+        Display names are left aligned even when they are all numbers, they
+        aren't parsed as numbers any more
+        """
+        self._trivia.on_get_display_name({'a': '7', 'b': '12345'}.get)
+        self._trivia.on_post_question(self.mock_ask_question)
+        self._trivia.handle_message('a', 'answer', 'payload')
+        self._trivia.handle_message('b', 'answer', 'payload')
+        self._trivia.handle_message('a', '!today', 'payload')
+        rows = self.mock_post_reply.call_args[0][0].strip().split('\n')[4:]
+        names = {row.split()[1]: row for row in rows}
+        self.assertCountEqual(names, ['7', '12345'])
+        self.assertEqual(names['7'].index(' 7 '), names['12345'].index(' 12345 '))
+
+    def test_display_name_cache(self):
+        """
+        Display names should only be looked up again once the cache expires
+        """
+        self.mock_display_name.side_effect = lambda x: x.upper()
+        self._trivia.on_get_display_name(self.mock_display_name)
+        self._trivia.on_post_question(self.mock_ask_question)
+        self._trivia.handle_message('a', 'answer', 'payload')
+        self._trivia.handle_message('a', '!today', 'payload')
+        self._trivia.handle_message('a', '!today', 'payload')
+        self.mock_display_name.assert_called_once_with('a')
+
+        self._trivia._config['display_name_cache_seconds'] = 0
+        self._trivia.handle_message('a', '!today', 'payload')
+        self.assertEqual(self.mock_display_name.call_count, 2)
+
+    def test_display_name_error(self):
+        """
+        A failing display name lookup should fall back to the uid, but only
+        for as long as a regular display name is cached
+        """
+        self.mock_display_name.side_effect = ConnectionError()
+        self._trivia.on_get_display_name(self.mock_display_name)
+        self._trivia.on_post_question(self.mock_ask_question)
+        self._trivia.handle_message('a', 'answer', 'payload')
+        self._trivia.handle_message('a', '!today', 'payload')
+        self._trivia.handle_message('a', '!today', 'payload')
+        self.mock_display_name.assert_called_once_with('a')
+        username = self.parse_scoreboard(self.mock_post_reply.call_args[0][0])[0][1]
+        self.assertEqual(username, 'a')
+
+        self._trivia._config['display_name_cache_seconds'] = 0
+        self._trivia.handle_message('a', '!today', 'payload')
+        self.assertEqual(self.mock_display_name.call_count, 2)
+
+    def test_display_name_gone(self):
+        """
+        A user that no longer exists should fall back to the uid and be kept
+        past the regular display name cache time
+        """
+        self.mock_display_name.return_value = None
+        self._trivia.on_get_display_name(self.mock_display_name)
+        self._trivia.on_post_question(self.mock_ask_question)
+        self._trivia._config['display_name_cache_seconds'] = 0
+        self._trivia.handle_message('a', 'answer', 'payload')
+        self._trivia.handle_message('a', '!today', 'payload')
+        self._trivia.handle_message('a', '!today', 'payload')
+        self.mock_display_name.assert_called_once_with('a')
+        username = self.parse_scoreboard(self.mock_post_reply.call_args[0][0])[0][1]
+        self.assertEqual(username, 'a')
+
+        self._trivia._config['display_name_gone_cache_seconds'] = 0
+        self._trivia.handle_message('a', '!today', 'payload')
+        self.assertEqual(self.mock_display_name.call_count, 2)
+
+    def test_bulk_display_names(self):
+        """
+        The bulk display names handler should resolve a scoreboard in one call
+        """
+        self.mock_display_name.side_effect = lambda x: x.upper()
+        self.mock_display_names.side_effect = lambda uids: {uid: uid.upper() * 2 for uid in uids if uid != 'c'}
+        self._trivia.on_get_display_name(self.mock_display_name)
+        self._trivia.on_get_display_names(self.mock_display_names)
+        self._trivia.on_post_question(self.mock_ask_question)
+        for uid in 'abc':
+            self._trivia.handle_message(uid, 'answer', 'payload')
+        self._trivia.handle_message('a', '!today', 'payload')
+        self.mock_display_names.assert_called_once()
+        self.assertCountEqual(self.mock_display_names.call_args[0][0], ['a', 'b', 'c'])
+        self.mock_display_name.assert_called_once_with('c')
+        names = [row[1] for row in self.parse_scoreboard(self.mock_post_reply.call_args[0][0])]
+        self.assertCountEqual(names, ['AA', 'BB', 'C'])
+
+        self._trivia.handle_message('a', '!today', 'payload')
+        self.mock_display_names.assert_called_once()
+
+        # a failing bulk lookup falls back to single lookups
+        self.mock_display_names.side_effect = ConnectionError()
+        self._trivia._config['display_name_cache_seconds'] = 0
+        self._trivia.handle_message('a', '!today', 'payload')
+        names = [row[1] for row in self.parse_scoreboard(self.mock_post_reply.call_args[0][0])]
+        self.assertCountEqual(names, ['A', 'B', 'C'])
+
+        # a deleted user shows as the uid and is kept past the regular cache time
+        self.mock_display_names.reset_mock(side_effect=True)
+        self.mock_display_names.side_effect = lambda uids: {uid: None if uid == 'c' else uid * 3 for uid in uids}
+        self.mock_display_name.reset_mock()
+        self._trivia.handle_message('a', '!today', 'payload')
+        names = [row[1] for row in self.parse_scoreboard(self.mock_post_reply.call_args[0][0])]
+        self.assertIn('c', names)
+        self.assertNotIn(call('c'), self.mock_display_name.call_args_list)
+
+        self._trivia.handle_message('a', '!today', 'payload')
+        self.assertNotIn('c', self.mock_display_names.call_args[0][0])
+        self.assertNotIn(call('c'), self.mock_display_name.call_args_list)
+
+    def test_scoreboard_without_lock(self):
+        """
+        Scoreboard commands shouldn't wait on an answer being processed
+        """
+        # Run it on another thread so taking the lock fails rather than hangs
+        thread = Thread(target=self._trivia.handle_message, args=('b', '!today', 'payload'), daemon=True)
+
+        with self._trivia._lock:
+            thread.start()
+            thread.join(timeout=5)
+            self.assertFalse(thread.is_alive())
+
+        self.mock_post_reply.assert_called()
+
+    def test_handlers_called_after_lock(self):
+        """
+        Platform handlers shouldn't be called while the message lock is held
+        """
+        lock_states = []
+        record_lock = lambda *_, **__: lock_states.append(self._trivia._lock.locked())
+        self._trivia.on_correct_answer(record_lock)
+        self._trivia.on_post_question(record_lock)
+        self._trivia.handle_message('a', 'answer', 'payload')
+        self.assertEqual(lock_states, [False, False, False])
+
+    def test_failing_handler(self):
+        """
+        A handler that raises shouldn't stop the next question being posted
+        """
+        self.mock_correct_answer.side_effect = ConnectionError()
+        self._trivia.on_correct_answer(self.mock_correct_answer)
+        self._trivia.on_post_question(self.mock_ask_question)
+        self.mock_ask_question.reset_mock()
+        self._trivia.handle_message('a', 'answer', 'payload')
+        self.mock_correct_answer.assert_called_once()
+        self.mock_ask_question.assert_called_once()
+        self.assertEqual(len(self._trivia._deferred), 0)
+
+    def test_slow_handler(self):
+        """
+        A slow platform handler on one thread shouldn't hold up answers on
+        another
+        """
+        release = Event()
+        self.mock_correct_answer.side_effect = lambda *_, **__: release.wait(30)
+        self._trivia.on_correct_answer(self.mock_correct_answer)
+        self._trivia.on_post_question(self.mock_ask_question)
+        self.mock_ask_question.reset_mock()
+
+        slow = Thread(target=self._trivia.handle_message, args=('a', 'answer', 'payload'), daemon=True)
+        slow.start()
+        self.addCleanup(slow.join, 5)
+        self.addCleanup(release.set)
+
+        # wait until the slow thread is stuck in the handler
+        for _ in range(500):
+            if self.mock_correct_answer.called:
+                break
+            sleep(.01)
+        self.mock_correct_answer.assert_called_once()
+
+        other = Thread(target=self._trivia.handle_message, args=('b', 'wrong', 'payload'), daemon=True)
+        other.start()
+        other.join(timeout=5)
+        self.assertFalse(other.is_alive())
+
+        # the slow thread still runs the calls queued after the slow one
+        release.set()
+        slow.join(timeout=5)
+        self.assertFalse(slow.is_alive())
+        self.mock_ask_question.assert_called_once()
+        self.assertEqual(len(self._trivia._deferred), 0)
+
+    def test_answer_for_old_question(self):
+        """
+        An answer checked against a question that has since been replaced
+        shouldn't count towards the new question
+        """
+        self._trivia.on_post_question(self.mock_ask_question)
+        old_question = self._trivia._current_question
+        self._trivia.handle_message('a', '!new', 'payload')
+        self.mock_ask_question.reset_mock()
+        self._trivia._run_locked(self._trivia._attempt_answer, 'b', old_question, True, 'payload')
+        self.mock_ask_question.assert_not_called()
+        self.assertEqual(len(self._trivia._attempts), 0)
+
     def test_skip_scoreboard_if_no_scores(self):
         """
         Make sure no scores are posted if suppress_no_scores=True and there
         are no scores
         """
-        mock_post_reply = Mock()
-        self._trivia.on_post_reply(mock_post_reply)
-        self._trivia.on_post_question(lambda *_, **__: None)
+        self._trivia.on_post_question(self.mock_ask_question)
         self._trivia._show_scores(suppress_no_scores=True, message_payload='payload')
-        mock_post_reply.assert_not_called()
+        self.mock_post_reply.assert_not_called()
 
     def test_scoreboard_no_payload(self):
         """
         When no message_payload is provided (like when run from a schedule)
         the scoreboard should be posted via post_message rather than post_reply
         """
-        mock_post_reply = Mock()
-        mock_post_message = Mock()
-        self._trivia.on_post_reply(mock_post_reply)
-        self._trivia.on_post_message(mock_post_message)
-        self._trivia.on_post_question(lambda *_, **__: None)
+        self._trivia.on_post_question(self.mock_ask_question)
         self._trivia._show_scores(suppress_no_scores=False)
-        mock_post_reply.assert_not_called()
-        mock_post_message.assert_called()
+        self.mock_post_reply.assert_not_called()
+        self.mock_post_message.assert_called()
 
     def test_correct_answer_callback(self):
         """
         Test correct answer callback
         """
         self._trivia.on_get_display_name(lambda x: x.upper())
-        mock_correct_callback = Mock()
-        self._trivia.on_correct_answer(mock_correct_callback)
-        self._trivia.on_post_question(lambda *_, **__: None)
+        self._trivia.on_correct_answer(self.mock_correct_answer)
+        self._trivia.on_post_question(self.mock_ask_question)
         self._trivia.handle_message('a', 'ablabla', 'payload')
-        mock_correct_callback.assert_not_called()
+        self.mock_correct_answer.assert_not_called()
         self._trivia.handle_message('a', 'answer', 'payload')
-        mock_correct_callback.assert_called()
+        self.mock_correct_answer.assert_called()
 
     def test_nonesense(self):
         """
@@ -299,28 +784,33 @@ class TestTriviaCore(unittest.TestCase):
             '`1`12l`129`j12///12`1\\\\',
             'This statement is false.',
         ]
-        mock_post_reply = Mock()
-        mock_post_message = Mock()
-        self._trivia.on_post_reply(mock_post_reply)
-        self._trivia.on_post_message(mock_post_message)
-        self._trivia.on_post_question(lambda *_, **__: None)
+        self._trivia.on_post_question(self.mock_ask_question)
         self._trivia.handle_message('b', 'blabla', 'payload')
         for word in nonsense:
-            mock_post_reply.reset_mock()
-            mock_post_message.reset_mock()
             self._trivia.handle_message('b', word, 'payload')
-            mock_post_reply.assert_not_called()
-            mock_post_message.assert_not_called()
+
+        # None of it should have been answered, checking once covers them all
+        self.assertEqual(self.mock_post_reply.mock_calls, [])
+        self.assertEqual(self.mock_post_message.mock_calls, [])
+
+    def test_blank_message(self):
+        """
+        Blank messages shouldn't be counted as wrong answers
+        """
+        self._trivia.on_post_question(self.mock_ask_question)
+        self._trivia.handle_message('b', ' \n', 'payload')
+        self._trivia.handle_message('a', 'answer', 'payload')
+        self._trivia.handle_message('a', '!today', 'payload')
+        scores = self.parse_scoreboard(self.mock_post_reply.call_args[0][0])
+        self.assertEqual([row[1] for row in scores], ['a'])
 
     def test_help(self):
         """
         Test the help message
         """
-        mock_post_reply = Mock()
-        self._trivia.on_post_reply(mock_post_reply)
         self._trivia.handle_message('b', '!help', 'payload')
-        mock_post_reply.assert_called()
-        help = mock_post_reply.call_args[0][0]
+        self.mock_post_reply.assert_called()
+        help = self.mock_post_reply.call_args[0][0]
         self.assertIn('!new', help)
         self.assertIn('!help', help)
 
@@ -328,328 +818,261 @@ class TestTriviaCore(unittest.TestCase):
         """
         Test uptime message, non-admin shouldn't be able to
         """
-        mock_post_reply = Mock()
-        self._trivia.on_post_reply(mock_post_reply)
         self._trivia.handle_message('b', '!uptime', 'payload')
         # b is not admin
-        mock_post_reply.assert_not_called()
+        self.mock_post_reply.assert_not_called()
 
         self._trivia.handle_message('a', '!uptime', 'payload')
-        mock_post_reply.assert_called()
-        uptime = mock_post_reply.call_args[0][0]
+        self.mock_post_reply.assert_called()
+        uptime = self.mock_post_reply.call_args[0][0]
         self.assertEqual(len(uptime.split(':')), 3)
 
-    def test_answer_matching(self):
-        correct_answers = (
-            ('test', 'test'),
-            ('python', 'python'),
-            ('five', '5'),
-            ('cdefg', 'abcdefghi'),
-            ('ONEtwoTHREE', 'onetwothree'),
-            ('one two three', 'onetwothree'),
-            ('Thom Yorke', 'Thom (Yorke)'),
-            ('one & two', 'one and two'),
-            ('pie', 'a pie'),
-            ('act', 'an act'),
-            ('cat', 'the cat'),
-            ('cliche', 'cliché'),
-            ('10%', '10 percent'),
-            (' abcde ', 'abcde'),
-        )
-
-        incorrect_answers = (
-            ('one', 'two'),
-            ('1', '2'),
-            ('1950s', '1960s'),
-            ('two', 'one two three'),
-            ('abcd', 'abcde'),
-            ('ab\ncde', 'abcde'),
-        )
-
-        for answer in correct_answers:
-            self.assertTrue(self._trivia._do_check_answer(*answer, 5))
-
-        for answer in incorrect_answers:
-            self.assertFalse(self._trivia._do_check_answer(*answer, 5))
-
-    @patch('trivia_core.time')
-    @patch('trivia_core.datetime')
-    def test_question(self, mock_datetime, mock_time):
+    def test_correct_answers(self):
+        for answer in CORRECT_ANSWERS:
+            with self.subTest(answer=answer):
+                self.assertTrue(self._trivia._do_check_answer(*answer, 5))
+
+    def test_incorrect_answers(self):
+        for answer in INCORRECT_ANSWERS:
+            with self.subTest(answer=answer):
+                self.assertFalse(self._trivia._do_check_answer(*answer, 5))
+
+    def test_question(self):
         """
         Test a bunch of scoreboard stuff.
         """
+        # Swap the clock directly, patch() is slow to enter and exit
+        fake_time = FakeTime()
+        fake_datetime = SimpleNamespace(today=None)
+        self.addCleanup(setattr, trivia_core, 'time', trivia_core.time)
+        self.addCleanup(setattr, trivia_core, 'datetime', trivia_core.datetime)
+        trivia_core.time = fake_time
+        trivia_core.datetime = fake_datetime
+
         self._trivia._config['scoreboard_show_incorrect'] = True
         self._trivia._config['scoreboard_show_percent'] = True
-        operations = (
-            (ln(), 'setdate', (2000, 1, 2)),
-            (ln(), 'wronganswer', 'a'),
-            (ln(), 'q_no_post', None),
-            (ln(), 'wronganswer', 'b'),
-            (ln(), 'q_no_post', None),
-            (ln(), 'answer', 'a'),
-            (ln(), 'q_post', {'uid': 'a', 'rank': 1}),
-            (ln(), 'answer', 'a'),
-            (ln(), 'q_post', {'uid': 'a', 'rank': 1}),
-            (ln(), 'answer', 'a'),
-            (ln(), 'q_post', {'uid': 'a', 'rank': 1}),
-            (ln(), 'answer', 'b'),
-            (ln(), 'q_post', {'uid': 'b', 'rank': 2}),
-            (ln(), 'answer', 'b'),
-            (ln(), 'q_post', {'uid': 'b', 'rank': 2}),
-            (ln(), 'answer', 'c'),
-            (ln(), 'q_post', {'uid': 'c', 'rank': 3}),
-            (ln(), 'scoreboard_cmd', ('!today', 'Sunday January 02 2000', (
-                ('a', 3, 0), # "a" gets it wrong then right so not in incorrect
-                ('b', 2, 1),
-                ('c', 1, 0),
-            ))),
-
-            (ln(), 'setdate', (2000, 1, 3)),
-            (ln(), 'scoreboard_cmd', ('!yesterday', 'Sunday January 02 2000', (
-                ('a', 3, 0),
-                ('b', 2, 1),
-                ('c', 1, 0),
-            ))),
-            (ln(), 'scoreboard', ({'days_ago': 2}, 'Saturday January 01 2000', (
-            ))),
-            (ln(), 'scoreboard', ({'days_ago': 2, 'suppress_no_scores': True}, 'Saturday January 01 2000', (
-            ))),
-            (ln(), 'scoreboard', ({'weeks_ago': 1}, 'week starting Sunday December 26 1999', (
-            ))),
-            (ln(), 'answer', 'b'),
-            (ln(), 'q_post', {'uid': 'b', 'rank': 1}),
-            (ln(), 'wronganswer', 'b'),
-            (ln(), 'q_no_post', None),
-            (ln(), 'answer', 'b'),
-            (ln(), 'q_post', {'uid': 'b', 'rank': 1}),
-            (ln(), 'scoreboard_cmd', ('!week', 'week starting Sunday January 02 2000', (
-                ('b', 4, 1),
-                ('a', 3, 0),
-                ('c', 1, 0),
-            ))),
-            (ln(), 'scoreboard_cmd', ('!month', 'January 2000', (
-                ('b', 4, 1),
-                ('a', 3, 0),
-                ('c', 1, 0),
-            ))),
-            (ln(), 'scoreboard_cmd', ('!year', '2000', (
-                ('b', 4, 1),
-                ('a', 3, 0),
-                ('c', 1, 0),
-            ))),
-            (ln(), 'scoreboard_cmd', ('!alltime', 'Alltime Scores', (
-                ('b', 4, 1),
-                ('a', 3, 0),
-                ('c', 1, 0),
-            ))),
-
-            (ln(), 'setdate', (2000, 2, 1)),
-            (ln(), 'answer', 'c'),
-            (ln(), 'answer', 'c'),
-            (ln(), 'wronganswer', 'a'),
-            (ln(), 'q_no_post', None),
-            (ln(), 'wronganswer', 'a'),
-            (ln(), 'q_no_post', None),
-            (ln(), 'wronganswer', 'a'), # only count 1 wrong per question
-            (ln(), 'q_no_post', None),
-            (ln(), 'answer', 'c'),
-            (ln(), 'answer', 'c'),
-            (ln(), 'wronganswer', 'c'),
-            (ln(), 'q_no_post', None),
-            (ln(), 'answer', 'b'),
-            (ln(), 'answer', 'b'),
-            (ln(), 'wronganswer', 'c'),
-            (ln(), 'q_no_post', None),
-            (ln(), 'answer', 'a'),
-            (ln(), 'scoreboard', ({'months_ago': 1}, 'January 2000', (
-                ('b', 4, 1),
-                ('a', 3, 0),
-                ('c', 1, 0),
-            ))),
-            (ln(), 'scoreboard_cmd', ('!today', 'Tuesday February 01 2000', (
-                ('c', 4, 2),
-                ('b', 2, 0),
-                ('a', 1, 1),
-            ))),
-            (ln(), 'scoreboard_cmd', ('!yesterday', 'Monday January 31 2000', (
-            ))),
-            (ln(), 'scoreboard_cmd', ('!month', 'February 2000', (
-                ('c', 4, 2),
-                ('b', 2, 0),
-                ('a', 1, 1),
-            ))),
-            (ln(), 'scoreboard_cmd', ('!alltime', 'Alltime Scores', (
-                ('b', 6, 1),
-                ('c', 5, 2),
-                ('a', 4, 1),
-            ))),
-            (ln(), 'answer', 'c'),
-            (ln(), 'q_post', {'uid': 'c', 'rank': 1}),
-            (ln(), 'answer', 'b'),
-            (ln(), 'q_post', {'uid': 'b', 'rank': 2}),
-            (ln(), 'answer', 'a'),
-            (ln(), 'q_post', {'uid': 'a', 'rank': 3}),
-            (ln(), 'answer', 'a'),
-            (ln(), 'q_post', {'uid': 'a', 'rank': 2}),
-            (ln(), 'answer', 'a'),
-            (ln(), 'q_post', {'uid': 'a', 'rank': 2}),
-            (ln(), 'answer', 'a'),
-            (ln(), 'q_post', {'uid': 'a', 'rank': 1}),
-            (ln(), 'answer', 'a'),
-            (ln(), 'q_post', {'uid': 'a', 'rank': 1}),
-            (ln(), 'answer', 'd'),
-            (ln(), 'q_post', {'uid': 'd', 'rank': 4}),
-            (ln(), 'scoreboard_cmd', ('!today', 'Tuesday February 01 2000', (
-                ('a', 6, 1),
-                ('c', 5, 2),
-                ('b', 3, 0),
-                ('d', 1, 0),
-            ))),
-
-
-
-            (ln(), 'setdate', (2001, 1, 1)),
-            (ln(), 'wronganswer', 'z'),
-            (ln(), 'q_no_post', None),
-            (ln(), 'answer', 'a'),
-            (ln(), 'answer', 'a'),
-            (ln(), 'answer', 'a'),
-            (ln(), 'answer', 'b'),
-            (ln(), 'answer', 'b'),
-            (ln(), 'answer', 'c'),
-            (ln(), 'scoreboard_cmd', ('!today', 'Monday January 01 2001', (
-                ('a', 3, 0),
-                ('b', 2, 0),
-                ('c', 1, 0),
-                ('z', 0, 1),
-            ))),
-            (ln(), 'scoreboard_cmd', ('!week', 'week starting Sunday December 31 2000', (
-                ('a', 3, 0),
-                ('b', 2, 0),
-                ('c', 1, 0),
-                ('z', 0, 1),
-            ))),
-            (ln(), 'scoreboard_cmd', ('!month', 'January 2001', (
-                ('a', 3, 0),
-                ('b', 2, 0),
-                ('c', 1, 0),
-                ('z', 0, 1),
-            ))),
-            (ln(), 'scoreboard_cmd', ('!year', '2001', (
-                ('a', 3, 0),
-                ('b', 2, 0),
-                ('c', 1, 0),
-                ('z', 0, 1),
-            ))),
-            (ln(), 'scoreboard_cmd', ('!alltime', 'Alltime Scores', (
-                ('a', 12, 1),
-                ('b', 9, 1),
-                ('c', 7, 2),
-                ('d', 1, 0),
-                ('z', 0, 1),
-            ))),
-            (ln(), 'scoreboard', ({'days_ago': 0}, 'Monday January 01 2001', (
-                ('a', 3, 0),
-                ('b', 2, 0),
-                ('c', 1, 0),
-                ('z', 0, 1),
-            ))),
-            (ln(), 'scoreboard', ({'weeks_ago': 1, 'suppress_no_scores': True}, 'week starting Sunday December 24 2000', (
-            ))),
-            (ln(), 'scoreboard', ({'weeks_ago': 1}, 'week starting Sunday December 24 2000', (
-            ))),
-            (ln(), 'scoreboard', ({'years_ago': 1}, '2000', (
-                ('a', 9, 1),
-                ('b', 7, 1),
-                ('c', 6, 2),
-                ('d', 1, 0),
-            ))),
-            (ln(), 'scoreboard', ({'months_ago': 12}, 'January 2000', (
-                ('b', 4, 1),
-                ('a', 3, 0),
-                ('c', 1, 0),
-            ))),
-            (ln(), 'scoreboard', ({'months_ago': -12}, 'January 2002', (
-            ))),
-            (ln(), 'scoreboard', ({'months_ago': 120}, 'January 1991', (
-            ))),
-            )
-        mock_ask_question = Mock()
-        mock_post_reply = Mock()
-        mock_post_message = Mock()
 
         # auto new question on new db
-        self._trivia.on_post_reply(mock_post_reply)
-        self._trivia.on_post_message(mock_post_message)
-        self._trivia.on_post_question(mock_ask_question)
-        mock_ask_question.assert_called_with(self.question_template(winning_user=None, question='question'))
-        mock_ask_question.reset_mock()
-
-
-        for line, op, dat in operations:
-            if op == 'setdate':
-                dt = datetime(*dat, 12, 30)
-                mock_datetime.today.return_value = dt
-                mock_time.side_effect = range(int(dt.timestamp()),int(dt.timestamp()) + 10000)
-
-            elif op == 'answer':
-                mock_ask_question.reset_mock()
-                self._trivia.handle_message(dat, 'answer', 'payload')
-
-            elif op == 'wronganswer':
-                mock_ask_question.reset_mock()
-                self._trivia.handle_message(dat, 'qwerty', 'payload')
-
-            elif op == 'q_post':
-                with self.subTest(f'Question asked with {str(dat)}'):
-                    mock_ask_question.assert_called_with(self.question_template(**dat))
-
-            elif op == 'q_no_post':
-                with self.subTest('Question not asked'):
-                    mock_ask_question.assert_not_called()
-
-            elif op in ('scoreboard_cmd', 'scoreboard'):
-                with self.subTest('Test scoreboard result'):
-                    cmd, date_str, exp_scores = dat
-
-                    mock_post_message.reset_mock()
-                    mock_post_reply.reset_mock()
-
-                    if op == 'scoreboard_cmd':
-                        self._trivia.handle_message('a', cmd, 'payload')
-
-                    else:
-                        self._trivia._show_scores(**cmd)
-
-                    if op == 'scoreboard' and cmd.get('suppress_no_scores', False) == True:
-                        mock_post_message.assert_not_called()
-                        mock_post_reply.assert_not_called()
-
-                        continue
-
-                    if op == 'scoreboard_cmd' or cmd.get('message_payload') is not None:
-                        scoreboard = mock_post_reply.call_args[0][0]
-                    else:
-                        scoreboard = mock_post_message.call_args[0][0]
-
-                    self.assertIn(scoreboard.split('\n')[0], (
-                        f'Scoreboard for {date_str}',
-                        date_str # Alltime Scores case
-                        ), f'line number {line}')
-                    scores = self.parse_scoreboard(scoreboard)
-                    self.assertEqual(len(scores), len(exp_scores))
-                    for i, exp_score in enumerate(exp_scores):
-                        self.assertEqual(scores[i], [
-                            str(i+1),
-                            exp_score[0],
-                            f'{int(exp_score[1]) * 200:,}',
-                            str(exp_score[1]),
-                            str(exp_score[2]),
-                            str(exp_score[1] * 100 // (exp_score[1] + exp_score[2]))
-                            ], f'line number {line}')
-
-            else:
-                self.assertTrue(False, f'unrecognized op on line: {line}')
+        self._trivia.on_post_question(self.mock_ask_question)
+        self.mock_ask_question.assert_called_with(self.question_template(winning_user=None, question='question'))
+        self.mock_ask_question.reset_mock()
+
+
+        def setdate(line, dat):
+            dt = datetime(*dat, 12, 30)
+            fake_datetime.today = lambda: dt
+            fake_time.t = int(dt.timestamp())
+
+        # Calls are counted from these marks rather than resetting the mocks
+        asked = 0
+
+        def answer(line, dat):
+            nonlocal asked
+            asked = self.mock_ask_question.call_count
+            self._trivia.handle_message(dat, 'answer', 'payload')
+
+        def wronganswer(line, dat):
+            nonlocal asked
+            asked = self.mock_ask_question.call_count
+            self._trivia.handle_message(dat, 'qwerty', 'payload')
+
+        def q_post(line, dat):
+            self.assertGreater(self.mock_ask_question.call_count, asked, f'line number {line}')
+            self.assertEqual(self.mock_ask_question.call_args, call(self.question_template(**dat)), f'line number {line}')
+
+        def q_no_post(line, dat):
+            self.assertEqual(self.mock_ask_question.call_count, asked, f'line number {line}')
+
+        def scoreboard(line, dat, from_command=False):
+            with self.subTest('Test scoreboard result'):
+                cmd, date_str, exp_scores = dat
+
+                messages = self.mock_post_message.call_count
+                replies = self.mock_post_reply.call_count
+
+                if from_command:
+                    self._trivia.handle_message('a', cmd, 'payload')
+
+                else:
+                    self._trivia._show_scores(**cmd)
+
+                if not from_command and cmd.get('suppress_no_scores', False) == True:
+                    self.assertEqual(self.mock_post_message.call_count, messages)
+                    self.assertEqual(self.mock_post_reply.call_count, replies)
+
+                    return
+
+                if from_command or cmd.get('message_payload') is not None:
+                    self.assertEqual(self.mock_post_reply.call_count, replies + 1)
+                    scoreboard = self.mock_post_reply.call_args[0][0]
+                else:
+                    self.assertEqual(self.mock_post_message.call_count, messages + 1)
+                    scoreboard = self.mock_post_message.call_args[0][0]
+
+                self.assertIn(scoreboard.split('\n')[0], (
+                    f'Scoreboard for {date_str}',
+                    date_str # Alltime Scores case
+                    ), f'line number {line}')
+                self.assertEqual(self.parse_scoreboard(scoreboard), expected_rows(exp_scores), f'line number {line}')
+
+        def scoreboard_cmd(line, dat):
+            scoreboard(line, dat, from_command=True)
+
+        handlers = {
+            'setdate': setdate,
+            'answer': answer,
+            'wronganswer': wronganswer,
+            'q_post': q_post,
+            'q_no_post': q_no_post,
+            'scoreboard': scoreboard,
+            'scoreboard_cmd': scoreboard_cmd,
+            }
+
+        for line, op, dat in QUESTION_OPERATIONS:
+            handler = handlers.get(op)
+            self.assertIsNotNone(handler, f'unrecognized op on line: {line}')
+            handler(line, dat)
+
+def show_page(show_number, clue_count=60):
+    """
+    A minimal j-archive game page with 12 categories and clue_count clues
+    between the round markers, plus a decoy category before them and a final
+    jeopardy clue after them
+    """
+    def category(name, comment):
+        return (
+            '<table><tr><td class="category_name">' + name + '</td></tr>'
+            '<tr><td class="category_comments">' + comment + '</td></tr></table>\n'
+            )
+
+    def clue(i):
+        if i == 5:
+            # an empty clue slot still counts towards the 60
+            return '<td class="clue">\n</td>\n'
+
+        question = f'question {i}'
+        if i == 7:
+            question = 'see <a href="https://example.com/7.jpg">this</a> &amp; that'
+
+        return (
+            '<td class="clue"><div onmouseover="toggle(&quot;&lt;em class=&quot;'
+            f'correct_response&quot;&gt;answer {i}&lt;/em&gt;&quot;)"></div>'
+            f'<td id="clue_{i}" class="clue_text">{question}</td></td>\n'
+            )
+
+    return ''.join([
+        f'<div id="game_title"><h1>Show #{show_number} - Monday, January 3, 2000</h1></div>\n',
+        category('DECOY', ''),
+        '<div id="jeopardy_round">\n',
+        *(category(f'Category {i}', '(Alex: comment &amp; more)' if i == 0 else '') for i in range(12)),
+        *(clue(i) for i in range(clue_count)),
+        '</div><div id="final_jeopardy_round">\n',
+        '<td class="clue"><div>correct_response&quot;&gt;final&lt;/em&gt;</div>'
+        '<td class="clue_text">final question</td></td>\n',
+        '</div>\n',
+        ])
+
+class TestScrape(unittest.TestCase):
+
+    def setUp(self):
+        self._con = sqlite3.connect(':memory:')
+        self.addCleanup(self._con.close)
+        scrape.create_tables(self._con)
+
+    def test_parse_page(self):
+        """
+        Categories and clues come from the two rounds only, in board order
+        """
+        known_shows = scrape.get_known_shows(self._con)
+        scrape.parse_page(show_page(1234), self._con, known_shows)
+        self.assertEqual(known_shows, {1234})
+
+        categories = self._con.execute(
+                'SELECT id, show_number, show_year, title, comment FROM category ORDER BY id').fetchall()
+        self.assertEqual([c[3] for c in categories], [f'Category {i}' for i in range(12)])
+        self.assertEqual({c[1:3] for c in categories}, {(1234, 2000)})
+        self.assertEqual(categories[0][4], 'comment & more')
+        self.assertEqual({c[4] for c in categories[1:]}, {None})
+
+        category_ids = [c[0] for c in categories]
+        questions = self._con.execute(
+                'SELECT category_id, value, question, answer, non_text FROM question ORDER BY id').fetchall()
+
+        # the empty clue slot is skipped, the final jeopardy clue is outside the rounds
+        self.assertEqual(len(questions), 59)
+        expected = [
+                (
+                    category_ids[scrape.CLUE_CATEGORY[i]],
+                    scrape.CLUE_VALUE[i],
+                    'see this & that' if i == 7 else f'question {i}',
+                    f'answer {i}',
+                    int(i == 7)
+                ) for i in range(60) if i != 5]
+        self.assertEqual(questions, expected)
+        self.assertEqual(questions[0][:2], (category_ids[0], 200))
+        self.assertEqual(questions[-1][:2], (category_ids[11], 1000))
+
+    def test_parse_page_wrong_clue_count(self):
+        """
+        A page with a missing clue shouldn't leave any rows behind
+        """
+        known_shows = set()
+
+        with self.assertRaises(IndexError):
+            scrape.parse_page(show_page(1234, clue_count=59), self._con, known_shows)
+
+        self.assertEqual(self._con.execute('SELECT COUNT(*) FROM category').fetchone()[0], 0)
+        self.assertEqual(self._con.execute('SELECT COUNT(*) FROM question').fetchone()[0], 0)
+        self.assertEqual(known_shows, set())
+
+    def test_parse_page_known_show(self):
+        """
+        Shows already in the database are skipped
+        """
+        known_shows = set()
+        scrape.parse_page(show_page(1234), self._con, known_shows)
+
+        with self.assertRaises(IndexError):
+            scrape.parse_page(show_page(1234), self._con, scrape.get_known_shows(self._con))
+
+        self.assertEqual(self._con.execute('SELECT COUNT(*) FROM category').fetchone()[0], 12)
+        self.assertEqual(self._con.execute('SELECT COUNT(*) FROM question').fetchone()[0], 59)
+
+    def test_rounds_content(self):
+        """
+        Only the jeopardy and double jeopardy rounds are parsed, unless the
+        markers are missing
+        """
+        page = show_page(1234)
+        rounds = scrape.get_rounds_content(page)
+        self.assertTrue(rounds.startswith(scrape.ROUNDS_START))
+        self.assertNotIn('DECOY', rounds)
+        self.assertNotIn('final question', rounds)
+        self.assertEqual(scrape.get_rounds_content('no markers'), 'no markers')
+
+    @patch('scrape.SESSION')
+    @patch('scrape.sleep')
+    @patch('scrape.monotonic', return_value=100.0)
+    def test_fetch_rate_limit(self, mock_monotonic, mock_sleep, mock_session):
+        """
+        All fetch workers together should reserve one request slot per
+        FETCH_INTERVAL
+        """
+        self.addCleanup(setattr, scrape, 'next_fetch_time', scrape.next_fetch_time)
+        scrape.next_fetch_time = 0
+        mock_session.get.return_value.content = b'page'
+
+        with ThreadPoolExecutor(max_workers=scrape.FETCH_WORKERS) as executor:
+            pages = list(executor.map(scrape.get_page, ['url'] * 12))
+
+        self.assertEqual(pages, ['page'] * 12)
+        self.assertEqual(mock_session.get.call_count, 12)
+
+        # with the clock stopped the first request goes straight away and
+        # every other one waits for its own slot, FETCH_INTERVAL after the last
+        waits = sorted(c.args[0] for c in mock_sleep.call_args_list)
+        self.assertEqual(waits, [k * scrape.FETCH_INTERVAL for k in range(1, 12)])
+        self.assertEqual(scrape.next_fetch_time, 100.0 + 12 * scrape.FETCH_INTERVAL)
 
 if __name__ == '__main__':
     unittest.main()
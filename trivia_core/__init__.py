@@ -7,6 +7,8 @@ import re
 import signal
 import logging
 from time import time, strftime, localtime
+from collections import Counter, deque
+from functools import lru_cache
 from datetime import datetime, timedelta
 from threading import Lock
 
@@ -26,6 +28,86 @@ SUGGESTED_CONFIGS = [
         ('scoreboard_schedule', []),
         ]
 
+# name, formatter and alignment of each scoreboard column
+SCOREBOARD_COLUMNS = (
+        ('rank', str, 'right'),
+        ('name', str, 'left'),
+        ('score', '{:,}'.format, 'right'),
+        ('correct', str, 'right'),
+        )
+SCOREBOARD_INCORRECT_COLUMN = ('incorrect', str, 'right')
+SCOREBOARD_PERCENT_COLUMN = ('percent', str, 'right')
+
+HELP_LINE = '{}{:<20}{}'.format
+
+REG_NUMBERS = re.compile(r'[0-9]+(?:[\.,][0-9]+)?')
+REG_DIGIT = re.compile(r'[0-9]')
+
+ANSWER_REPLACEMENTS = (('&', 'and'), ('%', 'percent'))
+ANSWER_ARTICLES = ('a ', 'an ', 'the ')
+ANSWER_PUNCTUATION = '\'().,"-'
+
+# Characters that can make an answer variant longer than the answer itself
+REG_GROWING_CHARACTERS = re.compile(r'[0-9&%]')
+
+def _unidecode_variants(answer):
+    if answer.isascii():
+        # Nothing for unidecode to change
+        return []
+
+    decoded = unidecode.unidecode(answer)
+    return [decoded] if decoded != answer else []
+
+# The same few numbers come up in answers and guesses over and over
+_num2words = lru_cache(maxsize=1024)(num2words)
+
+def _number_variants(answer):
+    if not REG_DIGIT.search(answer):
+        return []
+
+    return [REG_NUMBERS.sub(lambda match: _num2words(match.group(0)), answer)]
+
+def _replacement_variants(answer):
+    return [answer.replace(a, b) for a, b in ANSWER_REPLACEMENTS if a in answer]
+
+def _article_variants(answer):
+    return [answer[len(a):] for a in ANSWER_ARTICLES if answer.startswith(a)]
+
+def _space_variants(answer):
+    return [answer.replace(' ', '')]
+
+def _punctuation_variants(answer):
+    for char in ANSWER_PUNCTUATION:
+        if char in answer:
+            answer = answer.replace(char, '')
+
+    return [answer]
+
+# Applied in order, each to every variant produced before it
+ANSWER_FILTERS = (
+        _unidecode_variants,
+        _number_variants,
+        _replacement_variants,
+        _article_variants,
+        _space_variants,
+        _punctuation_variants,
+        )
+
+def _apply_config_defaults(config):
+    """
+    Warn about and fill in missing suggested config options
+    """
+    for key, default in SUGGESTED_CONFIGS:
+        if key not in config:
+            logging.warning(
+                    '%s not supplied to TriviaCore, defaulting to %s',
+                    key,
+                    repr(default)
+                    )
+            config[key] = default
+
+    return config
+
 class TriviaCore:
     """
     Core trivia components
@@ -35,20 +117,27 @@ class TriviaCore:
     def __init__(self, database_path, **kwargs):
         logging.info('Starting Trivia Core')
         self._config = kwargs
-        self._check_config()
+        _apply_config_defaults(self._config)
 
         self._lock = Lock()
+        self._deferred = deque()
+        self._deferred_lock = Lock()
+        self._draining = False
         self._starttime = time()
-        self._attempts = []
+        self._attempts = Counter()
         self._post_question_handler = lambda *_, **__: None
         self._post_message_handler = lambda *_, **__: None
         self._post_reply_handler = lambda *_, **__: None
         self._pre_format_handler = lambda x: x
         self._get_display_name_handler = lambda x: x
+        self._get_display_names_handler = None
+        self._display_names = {}
         self._correct_answer_handler = lambda *_, **__: None
         self._on_error_handler = lambda *_, **__: None
         self._db = TriviaDatabase(database_path)
         self._command_prefix = '!'
+        self._all_commands = self._build_commands()
+        self._command_map = {alias: c for c in self._all_commands for alias in c[0]}
         self._current_question = self._get_last_question()
         self._create_scoreboard_schedule(kwargs['scoreboard_schedule'])
 
@@ -66,14 +155,33 @@ class TriviaCore:
                                    the given message
         """
 
-        with self._lock:
-            if text.startswith(self._command_prefix):
-                self._handle_command(uid, text[1:], message_payload)
+        if text.strip() == '':
+            # Can't be a command or an answer, and shouldn't count as a miss
+            return
+
+        if text.startswith(self._command_prefix):
+            command_text = text[len(self._command_prefix):]
+
+            # Unknown and disabled commands are dropped without taking the lock
+            command = self._find_command(command_text)
+
+            if command is not None and command[3]:
+                self._run_locked(command[2], uid=uid, text=command_text, message_payload=message_payload)
+
+            elif command is not None:
+                # Scoreboards and help only read, they don't need the lock
+                command[2](uid=uid, text=command_text, message_payload=message_payload)
+
+            return
+
+        question = self._current_question
 
-            else:
-                if self._current_question is None:
-                    raise ValueError('There is no current question. Have you set your @on_post_question handler?')
-                self._attempt_answer(uid, text, message_payload)
+        if question is None:
+            raise ValueError('There is no current question. Have you set your @on_post_question handler?')
+
+        # Matching only reads the question, so do the expensive part unlocked
+        correct = self._check_answer(text, question)
+        self._run_locked(self._attempt_answer, uid, question, correct, message_payload)
 
     def on_pre_format(self, func):
         """Decorate your preformatted text handler function.
@@ -112,6 +220,7 @@ class TriviaCore:
 
         if self._current_question is None:
             self._new_question()
+            self._run_deferred()
 
         return func
 
@@ -161,10 +270,37 @@ class TriviaCore:
             uid (str): User's uid for which to get a display name
 
         Decorated function shall return:
-            str: The display name of the given uid
+            str: The display name of the given uid, or None if the user no
+                 longer exists
+
+        Display names are cached per uid for display_name_cache_seconds
+        (default 600). If the handler raises, the uid is shown instead for
+        the same time. If it returns None, the uid is shown and kept for
+        display_name_gone_cache_seconds (default 3600).
         """
 
         self._get_display_name_handler = func
+        self._display_names = {}
+
+        return func
+
+    def on_get_display_names(self, func):
+        """Decorate your bulk get display names handler function.
+
+        Optional. When set, scoreboards look up every uncached display name
+        with a single call instead of one get display name call per uid.
+
+        Decorated function shall accept arguments:
+            uids (list): User uids for which to get display names
+
+        Decorated function shall return:
+            dict: Display names keyed by uid, missing uids fall back to the
+                  get display name handler and a None value means the user
+                  no longer exists
+        """
+
+        self._get_display_names_handler = func
+        self._display_names = {}
 
         return func
 
@@ -195,21 +331,8 @@ class TriviaCore:
 
         return func
 
-    def _check_config(self):
-        for suggested in SUGGESTED_CONFIGS:
-            key = suggested[0]
-            default = suggested[1]
-            if key not in self._config:
-                logging.warning(
-                        '%s not supplied to TriviaCore, defaulting to %s',
-                        key,
-                        repr(default)
-                        )
-                self._config[key] = default
-
     def _create_scoreboard_schedule(self, schedules):
         self._sched = BackgroundScheduler()
-        self._sched.start()
 
         for schedule in schedules:
             self._job = self._sched.add_job(
@@ -219,6 +342,73 @@ class TriviaCore:
                 kwargs={**schedule['for'], 'suppress_no_scores': True},
                 replace_existing=False)
 
+        # Don't run a scheduler thread when no scoreboards are scheduled
+        if len(schedules) > 0:
+            self._sched.start()
+
+    def _display_name_cached(self, uid, now):
+        cached = self._display_names.get(uid)
+
+        if cached is None:
+            return False
+
+        if cached[2]:
+            max_age = self._config.get('display_name_gone_cache_seconds', 3600)
+        else:
+            max_age = self._config.get('display_name_cache_seconds', 600)
+
+        return now - cached[0] < max_age
+
+    def _cache_display_name(self, uid, name, now):
+        # A None name means the user has been deleted, hold on to the uid
+        # longer so it isn't looked up on every scoreboard
+        gone = name is None
+        if gone:
+            name = uid
+
+        self._display_names[uid] = (now, name, gone)
+
+        return name
+
+    def _get_display_name(self, uid):
+        now = time()
+
+        if self._display_name_cached(uid, now):
+            return self._display_names[uid][1]
+
+        try:
+            name = self._get_display_name_handler(uid)
+
+        except Exception as ex:
+            # Fall back to the uid until the next regular refresh, the
+            # lookup may well work next time
+            logging.exception(ex)
+            self._display_names[uid] = (now, uid, False)
+            return uid
+
+        return self._cache_display_name(uid, name, now)
+
+    def _prefetch_display_names(self, uids):
+        if self._get_display_names_handler is None:
+            return
+
+        now = time()
+        uids = [uid for uid in uids if not self._display_name_cached(uid, now)]
+
+        if len(uids) == 0:
+            return
+
+        try:
+            names = self._get_display_names_handler(uids)
+
+        except Exception as ex:
+            # _get_display_name will look them up one at a time instead
+            logging.exception(ex)
+            return
+
+        for uid, name in names.items():
+            self._cache_display_name(uid, name, now)
+
     def _get_new_question(self):
         """
         Select a random question from the database
@@ -233,52 +423,109 @@ class TriviaCore:
 
         return self._db.select_one('get_last_question', as_map=True)
 
+    def _run_locked(self, func, *args, **kwargs):
+        try:
+            with self._lock:
+                func(*args, **kwargs)
+
+        finally:
+            self._run_deferred()
+
+    def _defer(self, func, *args, **kwargs):
+        """
+        Queue a platform handler call until the message lock is released so
+        slow platform APIs don't hold up other messages
+        """
+
+        self._deferred.append((func, args, kwargs))
+
+    def _run_deferred(self):
+        """
+        Run queued platform handler calls in the order they were queued
+
+        Only one thread drains the queue at a time. Any other thread returns
+        straight away and leaves its calls to the thread already draining, so
+        a slow platform API only holds up that one thread.
+        """
+
+        with self._deferred_lock:
+            if self._draining:
+                return
+
+            self._draining = True
+
+        while True:
+            # Hold the lock only to take the next call, never while running it
+            with self._deferred_lock:
+                if len(self._deferred) == 0:
+                    self._draining = False
+                    return
+
+                func, args, kwargs = self._deferred.popleft()
+
+            # A failing handler mustn't hold back the calls queued after it
+            try:
+                func(*args, **kwargs)
+
+            except Exception as ex:
+                logging.exception(ex)
+
     def _new_question(self, winning_user=None):
         if self._current_question:
             winning_answer = self._current_question['answer']
         else:
             winning_answer = None
 
-        self._attempts = []
+        self._attempts = Counter()
         question = self._create_question_round()
-        self._post_question_handler({
+        self._defer(self._post_question_handler, {
             'winning_user': winning_user,
             'winning_answer': winning_answer,
             **question
             })
 
-    def _attempt_answer(self, uid:str, answer:str, message_payload):
-        self._attempts.append(uid)
+    def _attempt_answer(self, uid:str, question, correct:bool, message_payload):
+        if question is not self._current_question:
+            # The question was answered or skipped while this was checked
+            return
 
-        if self._check_answer(answer):
-            self._correct_answer_handler(message_payload, self._current_question)
+        self._attempts[uid] += 1
+
+        if correct:
+            self._defer(self._correct_answer_handler, message_payload, self._current_question)
 
             self._complete_question_round(winning_uid=uid)
 
-    def _handle_command(self, uid, text, message_payload):
-        for command in self._commands():
-            if text in command[0]:
-                command[2](uid=uid, text=text, message_payload=message_payload)
-                break
+    def _find_command(self, text):
+        command = self._command_map.get(text)
+
+        if command is None or self._command_disabled(command):
+            return None
+
+        return command
 
-    def _check_answer(self, answer):
+    def _command_disabled(self, command):
+        disabled_commands = self._config.get('disabled_commands', [])
+        return any(dc in command[0] for dc in disabled_commands)
+
+    def _check_answer(self, answer, question):
         """
-        Check an answer against the current question
+        Check an answer against the given question
         """
 
-        correct_answer = self._current_question['answer']
+        correct_answer = question['answer']
         return self._do_check_answer(
                 answer,
                 correct_answer,
                 self._config.get('min_matching_characters', 5)
                 )
 
-    def _player_attempt(self, uid, attempts, correct):
-        self._db.execute('player_attempt', {
+    def _player_attempts(self, winning_uid):
+        self._db.executemany('player_attempt', [{
             'uid': uid,
             'attempts': int(attempts),
-            'correct': int(correct)
-            }, auto_commit=True)
+            'correct': int(uid == winning_uid)
+            } for uid, attempts in self._attempts.items()])
 
     def _command_next(self, message_payload):
         start_time = self._db.select_one('get_current_round_start_time')[0]
@@ -288,7 +535,7 @@ class TriviaCore:
 
 
         if seconds_left > 0:
-            self.error(message_payload, f'Please wait {seconds_left} seconds to do that.')
+            self._defer(self.error, message_payload, f'Please wait {seconds_left} seconds to do that.')
 
         else:
             self._complete_question_round(None)
@@ -296,16 +543,15 @@ class TriviaCore:
     def _complete_question_round(self, winning_uid):
         logging.info('Question winner player id: %s', winning_uid or 'none')
 
-        for attempt_user in set(self._attempts):
-            self._add_user(attempt_user)
-            self._player_attempt(
-                    attempt_user,
-                    self._attempts.count(attempt_user),
-                    attempt_user == winning_uid
-                    )
+        # Record the whole round in a single commit
+        self._add_users(self._attempts)
+
+        self._player_attempts(winning_uid)
 
         self._update_question_round_table()
 
+        self._db.commit()
+
         winning_user = None
 
         if winning_uid:
@@ -316,69 +562,78 @@ class TriviaCore:
         self._new_question(winning_user)
 
     def _commands(self):
-        commands = (
+        return [c for c in self._all_commands if not self._command_disabled(c)]
+
+    def _build_commands(self):
+        return (
             (
                 ['exit'],
                 None, # Won't show in help message
-                self._command_exit
+                self._command_exit,
+                True # Runs under the message lock
             ),
             (
                 ['uptime'],
                 None, # Won't show in help message
-                self._command_uptime
+                self._command_uptime,
+                False
             ),
             (
                 ['new', 'trivia new'],
                 'Skip to the next question',
-                lambda *_, message_payload=None, **__: self._command_next(message_payload=message_payload)
+                lambda *_, message_payload=None, **__: self._command_next(message_payload=message_payload),
+                True
             ),
             (
                 ['alltime', 'score', 'scores'],
                 'Scores for all time',
-                lambda *_, message_payload=None, **__: self._show_scores(days_ago=None, suppress_no_scores=False, message_payload=message_payload)
+                lambda *_, message_payload=None, **__: self._show_scores(days_ago=None, suppress_no_scores=False, message_payload=message_payload),
+                False
             ),
             (
                 ['yesterday'],
                 'Scores for yesterday',
-                lambda *_, message_payload=None, **__: self._show_scores(days_ago=1, suppress_no_scores=False, message_payload=message_payload)
+                lambda *_, message_payload=None, **__: self._show_scores(days_ago=1, suppress_no_scores=False, message_payload=message_payload),
+                False
             ),
             (
                 ['today'],
                 'Scores for today',
-                lambda *_, message_payload=None, **__: self._show_scores(days_ago=0, suppress_no_scores=False, message_payload=message_payload)
+                lambda *_, message_payload=None, **__: self._show_scores(days_ago=0, suppress_no_scores=False, message_payload=message_payload),
+                False
             ),
             (
                 ['week'],
                 'Scores for this week',
-                lambda *_, message_payload=None, **__: self._show_scores(weeks_ago=0, suppress_no_scores=False, message_payload=message_payload)
+                lambda *_, message_payload=None, **__: self._show_scores(weeks_ago=0, suppress_no_scores=False, message_payload=message_payload),
+                False
             ),
             (
                 ['month'],
                 'Scores for this month',
-                lambda *_, message_payload=None, **__: self._show_scores(months_ago=0, suppress_no_scores=False, message_payload=message_payload)
+                lambda *_, message_payload=None, **__: self._show_scores(months_ago=0, suppress_no_scores=False, message_payload=message_payload),
+                False
             ),
             (
                 ['year'],
                 'Scores for this year',
-                lambda *_, message_payload=None, **__: self._show_scores(years_ago=0, suppress_no_scores=False, message_payload=message_payload)
+                lambda *_, message_payload=None, **__: self._show_scores(years_ago=0, suppress_no_scores=False, message_payload=message_payload),
+                False
             ),
             (
                 ['help'],
                 'Show this help info',
-                self._command_help
+                self._command_help,
+                False
             ),
         )
 
-        disabled_commands = self._config.get('disabled_commands', [])
-        commands = [c for c in commands if not any(dc in c[0] for dc in disabled_commands)]
-
-        return commands
-
-    def _add_user(self, uid):
-        self._db.execute('add_player', {
+    def _add_users(self, uids):
+        platform = self._config.get('platform')
+        self._db.executemany('add_player', [{
             'uid': uid,
-            'platform': self._config.get('platform')
-        }, auto_commit=True)
+            'platform': platform
+        } for uid in uids])
 
     def _create_question_round(self):
         self._current_question = self._get_new_question()
@@ -391,15 +646,12 @@ class TriviaCore:
         return self._current_question
 
     def _get_player_stats_timeframe(self, uid, start_time, end_time=None):
-        rows = self._db.select_iter('get_timeframe_scores', {
+        yield from self._db.select_iter('get_timeframe_scores', {
             'uid': uid,
             'start_time': start_time,
             'end_time': end_time,
         }, as_map=True)
 
-        for row in rows:
-            yield row
-
     def _update_question_round_table(self):
         params = {
             'complete_time': int(time()),
@@ -407,19 +659,16 @@ class TriviaCore:
 
         self._db.execute(
             'update_question_round',
-            params,
-            auto_commit=True
+            params
         )
 
     def _command_exit(self, *_, message_payload, **kwargs):
         if kwargs.get('uid') == self._config.get('admin_uid'):
-            self._post_reply_handler('ok bye', message_payload=message_payload)
-            self._do_exit()
+            self._defer(self._post_reply_handler, 'ok bye', message_payload=message_payload)
+            self._defer(self._do_exit)
 
     def _command_help(self, *_, message_payload, **__):
-        template = '{}{:<20}{}'
-        fmt = lambda x: template.format(self._command_prefix, x[0][0], x[1])
-        c_list = [fmt(x) for x in self._commands() if x[1] is not None]
+        c_list = [HELP_LINE(self._command_prefix, x[0][0], x[1]) for x in self._commands() if x[1] is not None]
         commands = '\n'.join(c_list)
         formatted = self._pre_format_handler(commands)
         self._post_reply_handler(formatted, message_payload=message_payload)
@@ -452,9 +701,11 @@ class TriviaCore:
         if suppress_no_scores and len(scores) == 0:
             return
 
+        self._prefetch_display_names([score['uid'] for score in scores])
+
         for score in scores:
             # Get the current display name from slack, limit to 32 chars
-            score['name'] = self._get_display_name_handler(score['uid'])[:32]
+            score['name'] = self._get_display_name(score['uid'])[:32]
 
         title2 = '=' * len(title)
         scoreboard = self._format_scoreboard(scores)
@@ -471,13 +722,20 @@ class TriviaCore:
 
     @staticmethod
     def _timestamp_midnight(days_ago=None, weeks_ago=None, months_ago=None, years_ago=None):
-        day_start = datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+        today = datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+        return TriviaCore._do_timestamp_midnight(today, days_ago, weeks_ago, months_ago, years_ago)
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def _do_timestamp_midnight(today, days_ago, weeks_ago, months_ago, years_ago):
+        # Cached per day, this runs for every correct answer and scoreboard
+        day_start = today
 
         if days_ago is not None:
             day_start = day_start - timedelta(days=days_ago)
 
         elif weeks_ago is not None:
-            day_of_week = (datetime.today().weekday() + 1) % 7
+            day_of_week = (today.weekday() + 1) % 7
             day_start = day_start - timedelta(day_of_week)
             day_start = day_start - timedelta(weeks_ago * 7)
 
@@ -519,54 +777,88 @@ class TriviaCore:
         return strftime(format_str,localtime(int(timestamp)))
 
     def _format_scoreboard(self, scores):
-        cols = [
-            ('rank', lambda x: x),
-            ('name', lambda x: x),
-            ('score', lambda x: f'{x:,}'),
-            ('correct', lambda x: x),
-        ]
+        if len(scores) == 0:
+            return ''
+
+        cols = list(SCOREBOARD_COLUMNS)
 
         if self._config.get('scoreboard_show_incorrect', False):
-            cols.append(('incorrect', lambda x: x))
+            cols.append(SCOREBOARD_INCORRECT_COLUMN)
 
         if self._config.get('scoreboard_show_percent', False):
-            cols.append(('percent', lambda x: x))
-
-        return tabulate([{col: fn(x[col]) for col, fn in cols} for x in scores], headers='keys')
+            cols.append(SCOREBOARD_PERCENT_COLUMN)
+
+        # Cells are preformatted, skip tabulate's per cell number parsing
+        return tabulate(
+                [[fn(x[col]) for col, fn, _ in cols] for x in scores],
+                headers=[col for col, _, _ in cols],
+                colalign=[align for _, _, align in cols],
+                disable_numparse=True
+                )
 
+    # Correct answers are expanded again for every attempt at a question
     @staticmethod
+    @lru_cache(maxsize=4096)
     def _answer_variants(answer):
-        answer_filters = [
-            lambda x: [unidecode.unidecode(x)] if unidecode.unidecode(x) != x else [],
-            lambda x: [re.sub(r'[0-9]+(?:[\.,][0-9]+)?', lambda y: num2words(y.group(0)), x)],
-            lambda x: [x.replace(a, b) for a,b in [['&', 'and'],['%', 'percent']] if a in x],
-            lambda x: [x[len(a):] for a in ['a ', 'an ', 'the '] if x.startswith(a)],
-            lambda x: [''.join([a for a in x if a not in ' '])],
-            lambda x: [''.join([a for a in x if a not in '\'().,"-'])],
-        ]
+        possible_answers = {answer.lower()}
+        for answer_filter in ANSWER_FILTERS:
+            new_answers = []
 
-        possible_answers = [answer.lower()]
-        for answer_filter in answer_filters:
+            # Each filter only sees the variants made before it
             for possible_answer in possible_answers:
                 try:
-                    possible_answers = list(set(
-                        [*possible_answers, *answer_filter(possible_answer)]
-                        ))
+                    new_answers.extend(answer_filter(possible_answer))
                 except Exception as ex:
                     logging.exception(ex)
 
-        return possible_answers
+            possible_answers.update(new_answers)
+
+        return frozenset(possible_answers)
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _correct_answer_matches(correct_answer, match_character_count):
+        """
+        Correct answer variations, each with the length a given answer needs
+        to match it, and the shortest of those lengths
+        """
+        variations = TriviaCore._answer_variants(correct_answer)
+        matches = tuple(
+                (variation, min(match_character_count, len(variation)))
+                for variation in variations
+                )
+        shortest = min(match_character_count, *(min_len for _, min_len in matches))
+        return variations, matches, shortest
 
     @staticmethod
     def _do_check_answer(answer, correct_answer, match_character_count):
-        correct_answer_variations = TriviaCore._answer_variants(correct_answer)
+        # Worked out once per question rather than once per attempt
+        correct_answer_variations, correct_answer_matches, shortest_match = (
+                TriviaCore._correct_answer_matches(correct_answer, match_character_count))
+
+        # Variants of plain ascii answers only ever lose characters, so an
+        # answer that is already too short can't match
+        if (answer.isascii() and
+            not REG_GROWING_CHARACTERS.search(answer) and
+            len(answer.strip(' ')) < shortest_match):
+            return False
+
         given_answer_variations = TriviaCore._answer_variants(answer)
 
-        for correct_answer_variation in correct_answer_variations:
-            for given_answer_variation in given_answer_variations:
-                min_match_len = min(match_character_count, len(correct_answer_variation))
-                if (len(given_answer_variation.strip(' ')) >= min_match_len and
-                    given_answer_variation.strip() in correct_answer_variation):
+        # Strip each given variation once rather than once per correct one
+        given_answer_variations = [
+                (len(variation.strip(' ')), variation.strip())
+                for variation in given_answer_variations
+                ]
+
+        # An exact match is always long enough
+        if any(variation in correct_answer_variations for _, variation in given_answer_variations):
+            return True
+
+        for correct_answer_variation, min_match_len in correct_answer_matches:
+            for given_len, given_answer_variation in given_answer_variations:
+                if (given_len >= min_match_len and
+                    given_answer_variation in correct_answer_variation):
                     return True
 
         return False
@@ -43,6 +43,14 @@ class TriviaDatabase:
             if auto_commit:
                 self._connection.commit()
 
+    def executemany(self, query_name, params_seq, auto_commit = False):
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.executemany(self._queries[query_name], params_seq)
+
+            if auto_commit:
+                self._connection.commit()
+
     def commit(self):
         with self._lock:
             self._connection.commit()